@@ -1,61 +1,340 @@
 import os
+import re
 from mistralai import Mistral
 import discord
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
-import pickle
+from googleapiclient.http import build_http
+from google_auth_httplib2 import AuthorizedHttp
+import threading
 from typing import Optional
-import requests
+import asyncio
+import time
+import hashlib
+import uuid
+import difflib
+from collections import OrderedDict, deque
+import aiohttp
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
-import json
+import orjson
 from timezonefinder import TimezoneFinder
-import pytz
 
 MISTRAL_MODEL = "mistral-large-latest"
 SYSTEM_PROMPT = """You are a helpful assistant with access to my calendar and location information.
 When responding to location queries, return the exact formatted location details provided without reformatting.
 For other queries, provide helpful and concise responses."""
+EVENT_JSON_PROMPT = """RESPOND WITH RAW JSON ONLY. NO CODE BLOCKS. NO MARKDOWN.
+Example:
+{
+    "summary": "Event title here",
+    "start_time": "2025-02-21T12:00:00-05:00",
+    "location": "Location here"
+}"""
+# Built once so every request starts with the same byte-stable prefix, which
+# provider-side prompt caching can reuse. Per-turn context goes in the user message.
+SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+EVENT_JSON_MSG = {"role": "system", "content": EVENT_JSON_PROMPT}
+# How long (seconds) slow-changing lookups are served from cache
+WEATHER_TTL = 600
+IP_LOCATION_TTL = 3600
+# Repeated identical questions within this window reuse the previous reply
+RESPONSE_CACHE_TTL = 60
+RESPONSE_CACHE_SIZE = 512
+# Intents that change the calendar and so invalidate cached replies
+CALENDAR_WRITE_INTENTS = frozenset({'create', 'postpone', 'update_location', 'attendees'})
+# Messages answered directly with location details (exact match only)
+LOCATION_QUERIES = frozenset({
+    'what is my location',
+    'where am i',
+    'what\'s my location',
+    'where',
+    'location',
+    'what is my current location',
+    'tell me my location'
+})
+# Phrases that trigger event creation, calendar context and travel context
+CREATE_PHRASES = frozenset({'schedule a', 'create event', 'add meeting', 'new appointment'})
+CALENDAR_WORDS = frozenset({'calendar', 'schedule', 'event', 'meeting'})
+TRAVEL_WORDS = frozenset({'far', 'distance', 'travel time', 'how long'})
+# Every trigger phrase labelled with the intent it signals
+INTENT_TRIGGERS = {
+    **dict.fromkeys(CREATE_PHRASES, 'create'),
+    **dict.fromkeys(CALENDAR_WORDS, 'calendar'),
+    **dict.fromkeys(TRAVEL_WORDS, 'travel'),
+    'postpone': 'postpone',
+    'update location': 'update_location',
+    'change location': 'update_location',
+    'add attendee': 'attendees',
+    'invite': 'attendees'
+}
+# One compiled scan finds all triggers. The lookahead lets matches at different
+# offsets overlap, but at each offset the alternation only reports the longest
+# phrase; any other trigger starting there is a prefix of it, so each phrase maps
+# to the intents of all its trigger prefixes (e.g. 'schedule a' -> create + calendar).
+_INTENT_PATTERN = re.compile('(?=(' + '|'.join(
+    re.escape(phrase) for phrase in sorted(INTENT_TRIGGERS, key=len, reverse=True)
+) + '))')
+_PREFIX_INTENTS = {
+    phrase: frozenset(intent for prefix, intent in INTENT_TRIGGERS.items() if phrase.startswith(prefix))
+    for phrase in INTENT_TRIGGERS
+}
+# Only the event fields the agent reads; keeps events().list responses small
+EVENT_LIST_FIELDS = 'items(id,summary,location,start,end,attendees)'
 SCOPES = [
     'https://www.googleapis.com/auth/calendar',  # Full access
     'https://www.googleapis.com/auth/calendar.events'  # Specific for events
 ]
+# HTTP statuses that mean "slow down / try again" rather than a real failure
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+MISTRAL_REQUESTS_PER_MINUTE = 60
+
+
+def _error_status(error: Exception) -> Optional[int]:
+    """Get the HTTP status from a Mistral, Google API or aiohttp error, if any"""
+    for attr in ('status_code', 'status'):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return status
+    # googleapiclient's HttpError keeps the status on its httplib2 response
+    return getattr(getattr(error, 'resp', None), 'status', None)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Get the Retry-After delay in seconds from an error's response headers, if any"""
+    headers = (getattr(getattr(error, 'raw_response', None), 'headers', None)
+               or getattr(error, 'headers', None)
+               or getattr(error, 'resp', None))
+    try:
+        return float(headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _detect_intents(text: str) -> set:
+    """Get the intents whose trigger phrases appear in text"""
+    intents = set()
+    for match in _INTENT_PATTERN.finditer(text):
+        intents |= _PREFIX_INTENTS[match.group(1)]
+    return intents
+
+
+def _parse_google_dt(value: str, tz) -> datetime:
+    """Parse a Google Calendar timestamp into tz (fromisoformat handles 'Z' since Python 3.11)"""
+    return datetime.fromisoformat(value).astimezone(tz)
+
+
+def _index_by_summary(events: list) -> dict:
+    """Map lowercased event summaries to events, keeping the earliest on duplicates"""
+    index = {}
+    for event in events:
+        index.setdefault(event.get('summary', '').lower(), event)
+    return index
+
+
+def _find_event(events: list, event_summary: str) -> Optional[dict]:
+    """Find an event by summary, falling back to a near-match only if it is unambiguous"""
+    index = _index_by_summary(events)
+    query = event_summary.lower()
+    if query in index:
+        return index[query]
+    matches = difflib.get_close_matches(query, index.keys(), n=2, cutoff=0.8)
+    return index[matches[0]] if len(matches) == 1 else None
+
+
+async def _none():
+    """Placeholder for a skipped lookup in asyncio.gather"""
+    return None
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limiter: halves capacity when throttled, adds 0.5 per success"""
+
+    def __init__(self, initial: int = 8, max_limit: int = 16, per_minute: int = None):
+        self.limit = float(initial)
+        self.max_limit = max_limit
+        self.per_minute = per_minute
+        self._in_flight = 0
+        self._cond = asyncio.Condition()
+        self._recent = deque()  # Start times of requests in the last minute
+
+    async def _acquire(self):
+        # Sliding one-minute window for providers with a requests-per-minute cap
+        while self.per_minute:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 60:
+                self._recent.popleft()
+            if len(self._recent) < self.per_minute:
+                self._recent.append(now)
+                break
+            await asyncio.sleep(60 - (now - self._recent[0]))
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < int(self.limit))
+            self._in_flight += 1
+
+    async def _release(self, outcome: str):
+        async with self._cond:
+            self._in_flight -= 1
+            if outcome == 'throttled':
+                self.limit = max(1.0, self.limit / 2)
+            elif outcome == 'ok':
+                self.limit = min(float(self.max_limit), self.limit + 0.5)
+            self._cond.notify_all()
+
+    async def call(self, fn, retries: int = 3):
+        """Await fn() within the limit, backing off and retrying when throttled"""
+        for attempt in range(retries + 1):
+            await self._acquire()
+            outcome = 'error'
+            try:
+                result = await fn()
+                outcome = 'ok'
+                return result
+            except Exception as e:
+                status = _error_status(e)
+                if status in RETRY_STATUSES:
+                    outcome = 'throttled'
+                if outcome != 'throttled' or attempt == retries:
+                    raise
+                delay = _retry_after(e) or 0.5 * 2 ** attempt
+                print(f"Rate limited ({status}), retrying in {delay:.1f}s")
+            finally:
+                await self._release(outcome)
+            await asyncio.sleep(delay)
+
 
 class MistralAgent:
+    # Calendar credentials and service shared by every agent in this process
+    _creds_cache = None
+    _svc_cache = None
+
     def __init__(self):
         MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
+        # HTTP session is created in setup() since it needs a running event loop
+        self._aio = None
         self.location = os.getenv("USER_LOCATION")
-        if not self.location:
-            self.location = self.get_ip_location()
         self.client = Mistral(api_key=MISTRAL_API_KEY)
         self.calendar_service = self.setup_calendar()
+        # Per-thread authorized transports for Calendar requests run via asyncio.to_thread
+        self._thread_local = threading.local()
         self.maps_api_key = os.getenv("GOOGLE_MAPS_API_KEY")
         # Add conversation memory
-        self.conversation_history = {}  # Store conversation by user ID
+        self.conversation_history = OrderedDict()  # Store conversation by user ID, least recent first
         self.memory_limit = 10  # Keep last 10 messages
-        self.tf = TimezoneFinder()
-        self.update_location_and_timezone()
+        self.max_users = 1000  # Forget the least recently active users beyond this
+        # Load timezone polygons into RAM once instead of reading shards on each lookup
+        self.tf = TimezoneFinder(in_memory=True)
+        # TTL cache for location/weather lookups: key -> (fetched_at, value)
+        self._cache = {}
+        self._cache_locks = {}
+        # Adaptive concurrency limits so message bursts back off instead of failing
+        self._mistral_limiter = AdaptiveLimiter(per_minute=MISTRAL_REQUESTS_PER_MINUTE)
+        # Calendar and Maps have separate quotas, so throttling on one must not slow the other
+        self._calendar_limiter = AdaptiveLimiter()
+        self._maps_limiter = AdaptiveLimiter()
+        # LRU of recent Mistral replies: key -> (created_at, reply)
+        self._response_cache = OrderedDict()
+        # Bumped on every calendar write so replies built from older calendar state never match
+        self._calendar_generation = 0
+
+    async def setup(self):
+        """Open the shared HTTP session and resolve location. Call once from the event loop."""
+        self._aio = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=64, limit_per_host=16, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=10)
+        )
+        if not self.location:
+            self.location = await self.get_ip_location()
+        await self.update_location_and_timezone()
+
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self._aio:
+            await self._aio.close()
+
+    async def _cached(self, key, ttl: float, fetch):
+        """Return cached value for key, awaiting fetch() on a miss (None is not cached)"""
+        entry = self._cache.get(key)
+        if entry and time.monotonic() - entry[0] < ttl:
+            return entry[1]
+        # Per-key lock so concurrent misses make only one request
+        lock = self._cache_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Another caller may have filled the entry while we waited
+            entry = self._cache.get(key)
+            if entry and time.monotonic() - entry[0] < ttl:
+                return entry[1]
+            value = await fetch()
+            if value is not None:
+                self._cache[key] = (time.monotonic(), value)
+            return value
+
+    async def _get_ip_api_data(self) -> Optional[dict]:
+        """Get ip-api.com lookup for this machine, or None if the service failed"""
+        async def fetch():
+            async with self._aio.get('http://ip-api.com/json/', timeout=aiohttp.ClientTimeout(total=5)) as response:
+                data = orjson.loads(await response.read())
+            return data if data['status'] == 'success' else None
+        return await self._cached('ip-api', IP_LOCATION_TTL, fetch)
+
+    def _response_cache_key(self, user_id: str, content: str, history) -> str:
+        """Build the response cache key for a user's message in its conversation"""
+        normalized = content.lower().strip()
+        # Key on the reply the question follows, so follow-ups like "why?" only match in the
+        # same spot. Earlier asks of this same question are skipped, so a repeat finds the
+        # key its first answer was stored under.
+        end = len(history)
+        while (end >= 2 and history[end - 2]['role'] == 'user'
+               and history[end - 2]['content'].lower().strip() == normalized):
+            end -= 2
+        previous_reply = history[end - 1]['content'] if end and history[end - 1]['role'] == 'assistant' else ''
+        key = hashlib.blake2b(f"{user_id}\0{self._calendar_generation}\0{normalized}\0".encode(),
+                              digest_size=16)
+        key.update(previous_reply.encode())
+        return key.hexdigest()
+
+    def _invalidate_responses(self):
+        """Drop cached replies after the calendar changes (it is shared by all users)"""
+        self._calendar_generation += 1
+        self._response_cache.clear()
+
+    def _get_cached_response(self, key: str) -> Optional[str]:
+        """Get a recent reply for key, if any"""
+        entry = self._response_cache.get(key)
+        if not entry:
+            return None
+        if time.monotonic() - entry[0] >= RESPONSE_CACHE_TTL:
+            del self._response_cache[key]
+            return None
+        self._response_cache.move_to_end(key)
+        return entry[1]
+
+    def _store_response(self, key: str, reply: str):
+        """Remember a reply, evicting the least recently used one when full"""
+        self._response_cache[key] = (time.monotonic(), reply)
+        self._response_cache.move_to_end(key)
+        if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
 
-    def get_ip_location(self) -> str:
+    async def get_ip_location(self) -> str:
         """Get location from IP address using multiple services for reliability"""
         try:
             # Try ip-api.com first (more accurate)
-            response = requests.get('http://ip-api.com/json/', timeout=5)
-            data = response.json()
-            if data['status'] == 'success':
+            data = await self._get_ip_api_data()
+            if data:
                 return f"{data['city']}, {data['regionName']}, {data['country']}"
 
             # Fallback to ipapi.co
-            response = requests.get('https://ipapi.co/json/', timeout=5)
-            data = response.json()
-            if response.status_code == 200:
+            async with self._aio.get('https://ipapi.co/json/', timeout=aiohttp.ClientTimeout(total=5)) as response:
+                data = orjson.loads(await response.read())
+            if response.status == 200:
                 return f"{data['city']}, {data['region']}, {data['country']}"
 
             # Try another fallback: ipinfo.io
-            response = requests.get('https://ipinfo.io/json', timeout=5)
-            data = response.json()
+            async with self._aio.get('https://ipinfo.io/json', timeout=aiohttp.ClientTimeout(total=5)) as response:
+                data = orjson.loads(await response.read())
             if 'city' in data and 'region' in data:
                 return f"{data['city']}, {data['region']}, {data['country']}"
 
@@ -70,12 +349,11 @@ class MistralAgent:
         return "Location unknown"  # Last resort fallback
 
     def setup_calendar(self):
-        creds = None
-        # The file token.pickle stores the user's access and refresh tokens
-        if os.path.exists('token.pickle'):
-            with open('token.pickle', 'rb') as token:
-                creds = pickle.load(token)
-                
+        creds = MistralAgent._creds_cache
+        # The file token.json stores the user's access and refresh tokens
+        if creds is None and os.path.exists('token.json'):
+            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+
         # If there are no (valid) credentials available, let the user log in
         if not creds or not creds.valid:
             if creds and creds.expired and creds.refresh_token:
@@ -85,38 +363,75 @@ class MistralAgent:
                     'credentials.json', SCOPES)
                 creds = flow.run_local_server(port=0)
             # Save the credentials for the next run
-            with open('token.pickle', 'wb') as token:
-                pickle.dump(creds, token)
-
-        return build('calendar', 'v3', credentials=creds)
+            with open('token.json', 'w') as token:
+                token.write(creds.to_json())
+
+        # Only rebuild the service when the credentials object changed
+        if MistralAgent._svc_cache is None or creds is not MistralAgent._creds_cache:
+            MistralAgent._svc_cache = build('calendar', 'v3', credentials=creds)
+        MistralAgent._creds_cache = creds
+        self._creds = creds
+        return MistralAgent._svc_cache
+
+    def _thread_http(self) -> AuthorizedHttp:
+        """Get this thread's authorized transport, reusing its keep-alive connections"""
+        # httplib2 is not thread-safe, so each worker thread keeps its own connection pool
+        http = getattr(self._thread_local, 'http', None)
+        if http is None:
+            # build_http() keeps googleapiclient's default socket timeout
+            http = AuthorizedHttp(self._creds, http=build_http())
+            self._thread_local.http = http
+        return http
+
+    async def _execute(self, request):
+        """Execute a Google API request in a worker thread under the rate limiter"""
+        def run():
+            return request.execute(http=self._thread_http())
+        return await self._calendar_limiter.call(lambda: asyncio.to_thread(run))
 
     async def get_upcoming_events(self, max_results=10):
         """Get upcoming events in local timezone"""
         now = self.get_local_time()
-        events_result = self.calendar_service.events().list(
+        events_result = await self._execute(self.calendar_service.events().list(
             calendarId='primary',
             timeMin=now.astimezone(timezone.utc).isoformat(),
             maxResults=max_results,
             singleEvents=True,
-            orderBy='startTime'
-        ).execute()
+            orderBy='startTime',
+            fields=EVENT_LIST_FIELDS
+        ))
         return events_result.get('items', [])
 
+    async def get_freebusy(self, start: datetime, end: datetime) -> list:
+        """Get busy intervals on the primary calendar between start and end"""
+        body = {
+            'timeMin': start.astimezone(timezone.utc).isoformat(),
+            'timeMax': end.astimezone(timezone.utc).isoformat(),
+            'items': [{'id': 'primary'}]
+        }
+        freebusy = await self._execute(self.calendar_service.freebusy().query(body=body))
+        return freebusy['calendars']['primary'].get('busy', [])
+
     async def get_weather(self) -> Optional[str]:
         """Get current weather for user's location"""
         api_key = os.getenv("WEATHER_API_KEY")
         if not api_key:
             return None
-            
+
+        # Extract just the city name from location string
+        city = self.location.split(',')[0].strip()
+        return await self._cached(('weather', city), WEATHER_TTL,
+                                  lambda: self._fetch_weather(city, api_key))
+
+    async def _fetch_weather(self, city: str, api_key: str) -> Optional[str]:
+        """Fetch current weather for a city from OpenWeather"""
         try:
-            # Extract just the city name from location string
-            city = self.location.split(',')[0].strip()
+            url = "http://api.openweathermap.org/data/2.5/weather"
+            params = {'q': city, 'appid': api_key, 'units': 'metric'}
+            async with self._aio.get(url, params=params) as response:
+                data = orjson.loads(await response.read())
             
-            url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&units=metric"
-            response = requests.get(url)
-            data = response.json()
-            
-            if response.status_code == 200:
+            if response.status == 200:
                 temp_c = data['main']['temp']
                 temp_f = (temp_c * 9/5) + 32  # Convert to Fahrenheit
                 return f"Current weather in {city}: {data['weather'][0]['description']}, {temp_c:.1f}°C ({temp_f:.1f}°F)"
@@ -134,61 +449,80 @@ class MistralAgent:
             return None
             
         try:
-            url = "https://maps.googleapis.com/maps/api/distancematrix/json"
             params = {
                 'origins': self.location,
                 'destinations': destination,
-                'mode': 'driving',
                 'key': self.maps_api_key
             }
-            driving = requests.get(url, params=params).json()
-            
-            params['mode'] = 'walking'
-            walking = requests.get(url, params=params).json()
+            # Driving and walking are independent requests, so fetch them concurrently
+            driving, walking = await asyncio.gather(
+                self._get_distance_matrix({**params, 'mode': 'driving'}),
+                self._get_distance_matrix({**params, 'mode': 'walking'})
+            )
             
             drive_time = driving['rows'][0]['elements'][0]['duration']['text']
             walk_time = walking['rows'][0]['elements'][0]['duration']['text']
             distance = driving['rows'][0]['elements'][0]['distance']['text']
             
             return f"Distance: {distance}\nDriving time: {drive_time}\nWalking time: {walk_time}"
-        except:
+        except Exception:
             return None
 
+    async def _get_distance_matrix(self, params: dict) -> dict:
+        """Fetch a single Distance Matrix response"""
+        url = "https://maps.googleapis.com/maps/api/distancematrix/json"
+        async def fetch():
+            async with self._aio.get(url, params=params, raise_for_status=True) as response:
+                return orjson.loads(await response.read())
+        return await self._maps_limiter.call(fetch)
+
     async def get_next_event_travel_info(self) -> Optional[str]:
         """Get travel info for next event"""
         events = await self.get_upcoming_events(1)
-        if not events:
+        event = events[0] if events else None
+        travel_info = None
+        if event and event.get('location'):
+            travel_info = await self.get_travel_time(event['location'])
+        return self._format_next_event_travel(event, travel_info)
+
+    def _format_next_event_travel(self, event: Optional[dict], travel_info: Optional[str]) -> str:
+        """Describe travel to the next event from an already fetched travel lookup"""
+        if not event:
             return "No upcoming events found."
             
-        event = events[0]
         location = event.get('location')
         if not location:
             return "Next event has no location specified."
             
         start_time = event['start'].get('dateTime', event['start'].get('date'))
-        start_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-        local_time = start_dt.astimezone(self.timezone)
+        local_time = _parse_google_dt(start_time, self.timezone)
         
-        travel_info = await self.get_travel_time(location)
         if not travel_info:
             return f"Could not calculate travel time to: {location}"
             
         return f"Next event: {event['summary']} at {local_time.strftime('%I:%M %p')}\nLocation: {location}\n{travel_info}"
 
+    async def _get_event_travel_time(self, event: dict) -> Optional[str]:
+        """Get travel times to an event's location, if it has one"""
+        if 'location' not in event:
+            return None
+        return await self.get_travel_time(event['location'])
+
     async def get_event_details(self, event) -> str:
         """Get detailed information about an event including attendees"""
+        return self._format_event_details(event, await self._get_event_travel_time(event))
+
+    def _format_event_details(self, event: dict, travel_info: Optional[str]) -> str:
+        """Describe an event from an already fetched travel lookup"""
         start_time = event['start'].get('dateTime', event['start'].get('date'))
-        start_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-        local_time = start_dt.astimezone(self.timezone)
+        local_time = _parse_google_dt(start_time, self.timezone)
         
         details = f"- {event['summary']} ({local_time.strftime('%I:%M %p %Z')})"
         
         if 'location' in event:
             details += f"\n  Location: {event['location']}"
-            if self.maps_api_key:
-                travel_info = await self.get_travel_time(event['location'])
-                if travel_info:
-                    details += f"\n  {travel_info}"
+            if travel_info:
+                details += f"\n  {travel_info}"
             
         if 'attendees' in event:
             details += "\n  Attendees:"
@@ -205,89 +539,90 @@ class MistralAgent:
             now = self.get_local_time()
             
             # Parse or create start time
-            if isinstance(start_time, str) and not start_time.endswith('Z'):
+            if isinstance(start_time, str) and not start_time.endswith('Z') and "tomorrow" in start_time.lower():
                 # Handle relative times like "tomorrow at noon"
-                if "tomorrow" in start_time.lower():
-                    start_dt = now + timedelta(days=1)
-                    start_dt = start_dt.replace(hour=12, minute=0, second=0, microsecond=0)
-                else:
-                    start_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                start_dt = start_dt.astimezone(self.timezone)
+                start_dt = (now + timedelta(days=1)).replace(hour=12, minute=0, second=0, microsecond=0)
             else:
-                start_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                start_dt = start_dt.astimezone(self.timezone)
+                start_dt = _parse_google_dt(start_time, self.timezone)
 
             # Set end time to 1 hour after start if not provided
             if not end_time:
                 end_dt = start_dt + timedelta(hours=1)
             else:
-                end_dt = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                end_dt = end_dt.astimezone(self.timezone)
+                end_dt = _parse_google_dt(end_time, self.timezone)
 
             event = {
                 'summary': summary,
                 'start': {
                     'dateTime': start_dt.isoformat(),
-                    'timeZone': str(self.timezone)
+                    'timeZone': self._tz_str
                 },
                 'end': {
                     'dateTime': end_dt.isoformat(),
-                    'timeZone': str(self.timezone)
+                    'timeZone': self._tz_str
                 }
             }
             
             if location:
                 event['location'] = location
 
+            # Client-generated id (base32hex) makes the insert safe to retry: if an attempt
+            # that failed with 5xx actually landed, the retry gets 409 instead of a duplicate
+            event['id'] = uuid.uuid4().hex
+
             print(f"Attempting to create event with data: {event}")
 
             # Create the event
-            created_event = self.calendar_service.events().insert(
-                calendarId='primary',
-                body=event,
-                sendUpdates='all'
-            ).execute()
+            try:
+                created_event = await self._execute(self.calendar_service.events().insert(
+                    calendarId='primary',
+                    body=event,
+                    sendUpdates='all',
+                    fields='htmlLink'
+                ))
+            except Exception as e:
+                if _error_status(e) != 409:
+                    raise
+                # An earlier attempt already created it
+                created_event = await self._execute(self.calendar_service.events().get(
+                    calendarId='primary',
+                    eventId=event['id'],
+                    fields='htmlLink'
+                ))
+            self._invalidate_responses()
             
             print(f"Event creation response: {created_event}")
-            
-            # Verify the event exists
-            verify_event = self.calendar_service.events().get(
-                calendarId='primary',
-                eventId=created_event['id']
-            ).execute()
-            
-            if verify_event:
-                return f"Event created successfully: {verify_event.get('htmlLink')}"
-            else:
-                return "Event creation failed verification"
-            
+
+            # The insert response already holds the created event, so no need to fetch it again
+            return f"Event created successfully: {created_event.get('htmlLink')}"
+
         except Exception as e:
             print(f"Error creating event: {str(e)}")
             import traceback
             print(traceback.format_exc())
             return f"Failed to create event: {str(e)}"
 
-    def get_conversation_history(self, user_id: str) -> list:
+    def get_conversation_history(self, user_id: str) -> deque:
         """Get conversation history for a user"""
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
-        return self.conversation_history[user_id]
+        if user_id in self.conversation_history:
+            self.conversation_history.move_to_end(user_id)
+            return self.conversation_history[user_id]
+        # Bounded deque drops the oldest message once the limit is reached
+        history = deque(maxlen=self.memory_limit)
+        self.conversation_history[user_id] = history
+        if len(self.conversation_history) > self.max_users:
+            self.conversation_history.popitem(last=False)
+        return history
 
     def add_to_history(self, user_id: str, role: str, content: str):
         """Add a message to conversation history"""
-        history = self.get_conversation_history(user_id)
-        history.append({"role": role, "content": content})
-        # Keep only the last N messages
-        if len(history) > self.memory_limit:
-            history.pop(0)
-        self.conversation_history[user_id] = history
+        self.get_conversation_history(user_id).append({"role": role, "content": content})
 
     async def get_location_details(self) -> str:
         """Get detailed location information"""
         try:
-            response = requests.get('http://ip-api.com/json/', timeout=5)
-            data = response.json()
-            if data['status'] == 'success':
+            data = await self._get_ip_api_data()
+            if data:
                 return (f"📍 Location: {data['city']}, {data['regionName']}, {data['country']}\n"
                        f"🌐 Coordinates: {data['lat']:.4f}°N, {data['lon']:.4f}°W\n"
                        f"🕒 Timezone: {self.timezone}\n"
@@ -301,52 +636,40 @@ class MistralAgent:
         msg_lower = message.content.lower()
 
         # Direct responses without going through Mistral
-        location_queries = [
-            'what is my location', 
-            'where am i', 
-            'what\'s my location', 
-            'where', 
-            'location',
-            'what is my current location',
-            'tell me my location'
-        ]
-        
-        if any(query == msg_lower for query in location_queries):  # Exact match only
+        if msg_lower in LOCATION_QUERIES:  # Exact match only
             return await self.get_location_details()
 
         # Get existing conversation history
         history = self.get_conversation_history(user_id)
 
         if msg_lower == "forget" or msg_lower == "reset":
-            self.conversation_history[user_id] = []
+            history.clear()
             return "I've reset our conversation history."
 
+        # Scan once for every intent trigger
+        intents = _detect_intents(msg_lower)
+        if intents & CALENDAR_WRITE_INTENTS:
+            self._invalidate_responses()
+
         # Check for event creation
-        if any(phrase in msg_lower for phrase in 
-               ['schedule a', 'create event', 'add meeting', 'new appointment']):
+        if 'create' in intents:
             try:
                 messages = [
-                    {"role": "system", "content": """RESPOND WITH RAW JSON ONLY. NO CODE BLOCKS. NO MARKDOWN.
-                    Example:
-                    {
-                        "summary": "Event title here",
-                        "start_time": "2025-02-21T12:00:00-05:00",
-                        "location": "Location here"
-                    }"""},
+                    EVENT_JSON_MSG,
                     {"role": "user", "content": "Create this event: " + message.content}
                 ]
 
-                response = await self.client.chat.complete_async(
+                response = await self._mistral_limiter.call(lambda: self.client.chat.complete_async(
                     model=MISTRAL_MODEL,
                     messages=messages,
-                )
+                ))
                 
                 content = response.choices[0].message.content.strip()
                 if content.startswith('```'):
                     content = content.split('\n', 1)[1]
                     content = content.rsplit('\n', 1)[0]
                 
-                event_info = json.loads(content)
+                event_info = orjson.loads(content)
                 result = await self.create_event(
                     summary=event_info['summary'],
                     start_time=event_info['start_time'],
@@ -361,7 +684,7 @@ class MistralAgent:
                 return f"Failed to create event: {str(e)}"
 
         # Check for postpone requests
-        if 'postpone' in msg_lower:
+        if 'postpone' in intents:
             try:
                 # Extract event name and hours
                 words = msg_lower.split()
@@ -388,7 +711,7 @@ class MistralAgent:
                 return f"Failed to postpone event: {str(e)}"
 
         # Check for location update requests
-        if 'update location' in msg_lower or 'change location' in msg_lower:
+        if 'update_location' in intents:
             try:
                 # Extract event name and location more reliably
                 if 'update location of' in msg_lower:
@@ -418,7 +741,7 @@ class MistralAgent:
                 return f"Failed to update event location: {str(e)}"
 
         # Check for attendee update requests
-        if 'add attendee' in msg_lower or 'invite' in msg_lower:
+        if 'attendees' in intents:
             try:
                 words = msg_lower.split()
                 event_name = None
@@ -441,66 +764,91 @@ class MistralAgent:
                 print("DEBUG - Error:", str(e))
                 return f"Failed to update event attendees: {str(e)}"
 
+        # Reuse the reply if the same question was just asked
+        cache_key = self._response_cache_key(user_id, message.content, history)
+        cached_reply = self._get_cached_response(cache_key)
+        if cached_reply is not None:
+            self.add_to_history(user_id, "user", message.content)
+            self.add_to_history(user_id, "assistant", cached_reply)
+            return cached_reply
+
         # Build context
         location_context = f"My location: {self.location}\n"  # Simplified location for context
-        
-        weather = await self.get_weather()
+        want_calendar = 'calendar' in intents
+        want_travel = 'travel' in intents
+
+        # The lookups are independent, so fetch them concurrently. With calendar
+        # context, next-event travel is built from those events instead of a second listing.
+        weather, events, travel_info = await asyncio.gather(
+            self.get_weather(),
+            self.get_upcoming_events(5) if want_calendar else _none(),
+            self.get_next_event_travel_info() if want_travel and not want_calendar else _none()
+        )
+
         if weather:
             location_context += f"{weather}\n"
 
         # Add calendar context if needed
         calendar_context = ""
-        if any(word in msg_lower for word in ['calendar', 'schedule', 'event', 'meeting']):
-            events = await self.get_upcoming_events(5)
+        if want_calendar:
             calendar_context = "Here are my upcoming events:\n"
-            for event in events:
-                calendar_context += await self.get_event_details(event) + "\n"
+            # Each event may need its own travel lookup, so run them concurrently
+            travel_infos = await asyncio.gather(*(self._get_event_travel_time(event) for event in events))
+            for event, event_travel in zip(events, travel_infos):
+                calendar_context += self._format_event_details(event, event_travel) + "\n"
+            if want_travel:
+                travel_info = self._format_next_event_travel(
+                    events[0] if events else None,
+                    travel_infos[0] if events else None
+                )
 
         # Add travel context if needed
-        if any(word in msg_lower for word in ['far', 'distance', 'travel time', 'how long']):
-            travel_info = await self.get_next_event_travel_info()
-            if travel_info:
-                location_context += f"\n{travel_info}\n"
+        if travel_info:
+            location_context += f"\n{travel_info}\n"
 
         # Build messages list with history
         messages = [
-            {"role": "system", "content": SYSTEM_PROMPT}
-        ] + history + [
+            SYSTEM_MSG,
+            *history,
             {"role": "user", "content": f"{location_context}{calendar_context}\n{message.content}"}
         ]
 
-        response = await self.client.chat.complete_async(
+        response = await self._mistral_limiter.call(lambda: self.client.chat.complete_async(
             model=MISTRAL_MODEL,
             messages=messages,
-        )
+        ))
+
+        reply = response.choices[0].message.content
+        self._store_response(cache_key, reply)
 
         # Add the new exchange to history
         self.add_to_history(user_id, "user", message.content)
-        self.add_to_history(user_id, "assistant", response.choices[0].message.content)
+        self.add_to_history(user_id, "assistant", reply)
 
-        return response.choices[0].message.content
+        return reply
 
-    def update_location_and_timezone(self):
+    async def update_location_and_timezone(self):
         """Update location and get local timezone"""
         try:
             # Get precise location using IP
-            response = requests.get('http://ip-api.com/json/', timeout=5)
-            data = response.json()
-            if data['status'] == 'success':
+            data = await self._get_ip_api_data()
+            if data:
                 self.location = f"{data['city']}, {data['regionName']}, {data['country']}"
                 self.latitude = data['lat']
                 self.longitude = data['lon']
                 
                 # Get timezone from coordinates
                 timezone_str = self.tf.timezone_at(lat=self.latitude, lng=self.longitude)
-                self.timezone = pytz.timezone(timezone_str)
+                self.timezone = ZoneInfo(timezone_str)
                 print(f"Located in timezone: {timezone_str}")
             else:
                 raise Exception("Location service failed")
         except Exception as e:
             print(f"Error updating location: {str(e)}")
             # Fallback to system timezone
-            self.timezone = pytz.timezone('America/Los_Angeles')  # Default to Pacific Time
+            self.timezone = ZoneInfo('America/Los_Angeles')  # Default to Pacific Time
+        # IANA name sent with every event body
+        self._tz_str = str(self.timezone)
             
     def get_local_time(self) -> datetime:
         """Get current time in local timezone"""
@@ -510,10 +858,10 @@ class MistralAgent:
         """Modify an existing calendar event"""
         try:
             # Get the existing event
-            event = self.calendar_service.events().get(
+            event = await self._execute(self.calendar_service.events().get(
                 calendarId='primary',
                 eventId=event_id
-            ).execute()
+            ))
 
             # Create a copy of the existing event
             updated_event = event.copy()
@@ -528,12 +876,14 @@ class MistralAgent:
                     updated_event[key] = value
 
             # Update the event
-            result = self.calendar_service.events().update(
+            result = await self._execute(self.calendar_service.events().update(
                 calendarId='primary',
                 eventId=event_id,
                 body=updated_event,
-                sendUpdates='all'
-            ).execute()
+                sendUpdates='all',
+                fields='htmlLink'
+            ))
+            self._invalidate_responses()
 
             print(f"Event update response: {result}")  # Debug print
             return f"Event updated successfully: {result.get('htmlLink')}"
@@ -549,23 +899,14 @@ class MistralAgent:
         try:
             # Find the event
             events = await self.get_upcoming_events(10)
-            target_event = None
-            
-            for event in events:
-                if event['summary'].lower() == event_summary.lower():
-                    target_event = event
-                    break
+            target_event = _find_event(events, event_summary)
             
             if not target_event:
                 return f"Could not find event '{event_summary}'"
 
             # Get current start and end times
-            start_time = datetime.fromisoformat(
-                target_event['start']['dateTime'].replace('Z', '+00:00')
-            )
-            end_time = datetime.fromisoformat(
-                target_event['end']['dateTime'].replace('Z', '+00:00')
-            )
+            start_time = _parse_google_dt(target_event['start']['dateTime'], self.timezone)
+            end_time = _parse_google_dt(target_event['end']['dateTime'], self.timezone)
 
             # Add hours
             new_start = start_time + timedelta(hours=hours)
@@ -575,17 +916,17 @@ class MistralAgent:
             changes = {
                 'start': {
                     'dateTime': new_start.isoformat(),
-                    'timeZone': str(self.timezone)
+                    'timeZone': self._tz_str
                 },
                 'end': {
                     'dateTime': new_end.isoformat(),
-                    'timeZone': str(self.timezone)
+                    'timeZone': self._tz_str
                 }
             }
 
             # Update the event
             result = await self.modify_event(target_event['id'], changes)
-            return f"Event '{event_summary}' postponed by {hours} hours.\n{result}"
+            return f"Event '{target_event.get('summary', event_summary)}' postponed by {hours} hours.\n{result}"
 
         except Exception as e:
             print(f"Error postponing event: {str(e)}")
@@ -596,12 +937,7 @@ class MistralAgent:
         try:
             # Find the event
             events = await self.get_upcoming_events(10)
-            target_event = None
-            
-            for event in events:
-                if event['summary'].lower() == event_summary.lower():
-                    target_event = event
-                    break
+            target_event = _find_event(events, event_summary)
             
             if not target_event:
                 return f"Could not find event '{event_summary}'"
@@ -613,7 +949,7 @@ class MistralAgent:
 
             # Update the event
             result = await self.modify_event(target_event['id'], changes)
-            return f"Updated location for '{event_summary}' to: {new_location}\n{result}"
+            return f"Updated location for '{target_event.get('summary', event_summary)}' to: {new_location}\n{result}"
 
         except Exception as e:
             print(f"Error updating event location: {str(e)}")
@@ -624,12 +960,7 @@ class MistralAgent:
         try:
             # Find the event
             events = await self.get_upcoming_events(10)
-            target_event = None
-            
-            for event in events:
-                if event['summary'].lower() == event_summary.lower():
-                    target_event = event
-                    break
+            target_event = _find_event(events, event_summary)
             
             if not target_event:
                 return f"Could not find event '{event_summary}'"
@@ -649,7 +980,7 @@ class MistralAgent:
 
             # Update the event
             result = await self.modify_event(target_event['id'], changes)
-            return f"Updated attendees for '{event_summary}'\nNew attendees: {', '.join(attendees)}\n{result}"
+            return f"Updated attendees for '{target_event.get('summary', event_summary)}'\nNew attendees: {', '.join(attendees)}\n{result}"
 
         except Exception as e:
             print(f"Error updating event attendees: {str(e)}")
@@ -17,7 +17,26 @@ load_dotenv()
 # Create the bot with all intents
 # The message content and members intent must be enabled in the Discord Developer Portal for the bot to work.
 intents = discord.Intents.all()
-bot = commands.Bot(command_prefix=PREFIX, intents=intents)
+
+
+class AgentBot(commands.Bot):
+    async def setup_hook(self):
+        """
+        Called once after login, before connecting to the gateway.
+        Sets up the agent's HTTP session on the bot's event loop.
+        """
+        await agent.setup()
+
+    async def close(self):
+        """
+        Called when the bot shuts down, including on Ctrl-C.
+        Closes the agent's HTTP session after disconnecting from Discord.
+        """
+        await super().close()
+        await agent.close()
+
+
+bot = AgentBot(command_prefix=PREFIX, intents=intents)
 
 # Import the Mistral agent from the agent.py file
 agent = MistralAgent()
@@ -0,0 +1,70 @@
+import asyncio
+import importlib.util
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+# Stub out third-party clients that aren't installed so agent.py can be imported offline
+for name in ('mistralai', 'discord', 'aiohttp', 'timezonefinder',
+             'google', 'google.oauth2', 'google.oauth2.credentials',
+             'google.auth', 'google.auth.transport', 'google.auth.transport.requests',
+             'google_auth_oauthlib', 'google_auth_oauthlib.flow',
+             'googleapiclient', 'googleapiclient.discovery', 'googleapiclient.http',
+             'google_auth_httplib2'):
+    try:
+        found = importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        found = False
+    if not found:
+        sys.modules.setdefault(name, mock.MagicMock())
+
+import agent  # noqa: E402
+
+
+def make_agent():
+    with mock.patch.object(agent.MistralAgent, 'setup_calendar', return_value=mock.MagicMock()), \
+         mock.patch.object(agent, 'Mistral'), mock.patch.object(agent, 'TimezoneFinder'):
+        bot_agent = agent.MistralAgent()
+    bot_agent.location = "Paris, Ile-de-France, France"
+    bot_agent.timezone = agent.ZoneInfo('Europe/Paris')
+    bot_agent._tz_str = 'Europe/Paris'
+    bot_agent.get_weather = mock.AsyncMock(return_value=None)
+    bot_agent.client.chat.complete_async = mock.AsyncMock(side_effect=lambda **kwargs: SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(
+            content=f"reply {bot_agent.client.chat.complete_async.await_count}"))]
+    ))
+    return bot_agent
+
+
+def message(content, user_id=1):
+    return SimpleNamespace(author=SimpleNamespace(id=user_id), content=content)
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_repeated_question_skips_mistral(self):
+        bot_agent = make_agent()
+
+        async def ask_three_times():
+            return [await bot_agent.run(message("What is the capital of France")) for _ in range(3)]
+
+        replies = asyncio.run(ask_three_times())
+        self.assertEqual(bot_agent.client.chat.complete_async.await_count, 1)
+        self.assertEqual(replies, ["reply 1"] * 3)
+
+    def test_follow_up_after_different_reply_misses(self):
+        bot_agent = make_agent()
+
+        async def conversation():
+            await bot_agent.run(message("tell me about rome"))
+            await bot_agent.run(message("why?"))
+            await bot_agent.run(message("tell me about oslo"))
+            return await bot_agent.run(message("why?"))
+
+        reply = asyncio.run(conversation())
+        self.assertEqual(bot_agent.client.chat.complete_async.await_count, 4)
+        self.assertEqual(reply, "reply 4")
+
+
+if __name__ == '__main__':
+    unittest.main()